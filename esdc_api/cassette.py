@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+esdc_api.cassette
+~~~~~~~~~~~~~~~~~
+
+This module contains the :class:`Cassette` class, which can record HTTP exchanges performed by the Danube Cloud API
+:class:`.Client` and replay them later without a running Danube Cloud API server.
+
+A cassette is used as a :class:`.Client` transport::
+
+    >>> cassette = Cassette()
+    >>> es = Client(api_url='https://danube.cloud/api', api_key='<your-api-key>', transport=cassette.record())
+    >>> es.put('/vm/example.com/status/start').content
+    >>> cassette.save('/tmp/vm-start.cassette')
+
+    >>> cassette = Cassette.load('/tmp/vm-start.cassette')
+    >>> es = Client(api_url='https://danube.cloud/api', transport=cassette.replay())
+    >>> es.put('/vm/example.com/status/start').content
+"""
+
+import gzip
+import json
+import hashlib
+import time
+from collections import deque
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .client import iter_chunks
+from .exceptions import ESAPIRuntimeError
+
+__all__ = (
+    'Cassette',
+)
+
+# Bytes are stored as latin-1 strings, which maps every byte to exactly one character
+_ENCODING = 'latin-1'
+
+
+def _encode(data):
+    """Convert bytes into a JSON serializable string."""
+    return data.decode(_ENCODING)
+
+
+def _decode(data):
+    """Convert a string created by :func:`_encode` back to bytes."""
+    return data.encode(_ENCODING)
+
+
+class _RecordedResponse(object):
+    """Proxy around the :class:`requests.Response <requests.Response>` object, which stores all body data (and the time
+    when it arrived) into a cassette exchange while the body is being consumed by the :class:`.Response` object."""
+    def __init__(self, response, exchange, started):
+        self._response = response
+        self._exchange = exchange
+        self._body = exchange['response']['body']
+        self._last = started
+        self._content = None
+        self._consumed = False
+
+    def __getattr__(self, name):
+        if name.startswith('_'):  # Private attributes are never delegated (e.g. during unpickling)
+            raise AttributeError(name)
+
+        return getattr(self._response, name)
+
+    def _record(self, data):
+        """Append data to the body. Consecutive keepalive (whitespace) chunks and consecutive data chunks are merged
+        into one segment in order to keep the cassette compact."""
+        now = time.time()
+        delay = now - self._last
+        self._last = now
+
+        if not data:
+            return
+
+        body = self._body
+
+        if body:
+            last_delay, last_data = body[-1]
+
+            if last_data.isspace() == data.isspace():
+                body[-1] = [last_delay + delay, last_data + _encode(data)]
+                return
+
+        body.append([delay, _encode(data)])
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for chunk in self._response.iter_content(chunk_size=chunk_size, decode_unicode=decode_unicode):
+            self._record(chunk)
+            yield chunk
+
+        self._consumed = True
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self._response.content
+            self._record(self._content)
+            self._consumed = True
+
+        return self._content
+
+    def finish(self):
+        """Fetch the rest of the body (if not already consumed)."""
+        if not self._consumed:
+            # noinspection PyStatementEffect
+            self.content
+
+
+def _normalize_json(data):
+    """Return JSON encoded parameters with sorted keys as bytes."""
+    try:
+        data = json.dumps(json.loads(data), sort_keys=True)
+    except ValueError:
+        pass
+
+    return data.encode('utf-8')
+
+
+def _digest_chunks(chunks, request):
+    """Pass through all chunks of request data and store the SHA-1 digest and size of the whole data into the
+    request."""
+    digest = hashlib.sha1()
+    size = 0
+
+    for chunk in chunks:
+        digest.update(chunk)
+        size += len(chunk)
+        yield chunk
+
+    request['data_digest'] = digest.hexdigest()
+    request['data_size'] = size
+
+
+def _get_request(method, url, params=None, data=None, stream=False):
+    """Return a recorded request dictionary together with the request data, which should be sent instead of the
+    original data. A streamed request body is not stored; only its digest and size are stored while the returned
+    generator is being consumed (stream=True) or right away (stream=False)."""
+    request = {
+        'method': method.upper(),
+        'url': url,
+        'params': params,
+        'data': None,
+        'data_digest': None,
+        'data_size': 0,
+    }
+
+    if data is None:
+        return request, data
+
+    if isinstance(data, bytes):
+        request['data'] = _encode(data)
+        chunks = (data,)
+    elif isinstance(data, str):  # JSON encoded parameters
+        request['data'] = data
+        chunks = (_normalize_json(data),)
+    else:  # Streamed request body
+        chunks = iter_chunks(data)
+
+        if stream:
+            return request, _digest_chunks(chunks, request)
+
+    for _ in _digest_chunks(chunks, request):
+        pass
+
+    return request, data
+
+
+def _get_request_key(request):
+    """Return a key used for matching requests with recorded exchanges."""
+    return (request['method'], request['url'], json.dumps(request['params'], sort_keys=True, default=str),
+            request.get('data_digest', None))
+
+
+class _ReplayedResponse(object):
+    """Object emulating the :class:`requests.Response <requests.Response>` object created from a recorded exchange."""
+    def __init__(self, exchange, realtime=False):
+        request = exchange['request']
+        response = exchange['response']
+        self.method = request['method']
+        self.url = response['url']
+        self.status_code = response['status_code']
+        self.reason = response.get('reason', None)
+        self.headers = CaseInsensitiveDict(response['headers'])
+        self._segments = [(delay, _decode(data)) for delay, data in response['body']]
+        self._realtime = realtime
+        self._index = 0
+        self._offset = 0
+        self._content = None
+
+    def _read(self, size=None):
+        """Return next piece of body data (not longer than size) or empty bytes if the body is exhausted.
+        In realtime mode the recorded delay is spread proportionally over all pieces of a segment."""
+        segments = self._segments
+
+        while self._index < len(segments):
+            delay, data = segments[self._index]
+
+            if self._offset >= len(data):
+                self._index += 1
+                self._offset = 0
+                continue
+
+            if size is None:
+                piece = data[self._offset:]
+            else:
+                piece = data[self._offset:self._offset + size]
+
+            if self._realtime and delay > 0:
+                time.sleep(delay * len(piece) / len(data))
+
+            self._offset += len(piece)
+
+            return piece
+
+        return b''
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        while True:
+            piece = self._read(chunk_size)
+
+            if not piece:
+                break
+
+            if decode_unicode:
+                piece = piece.decode('utf-8')
+
+            yield piece
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = b''.join(iter(self._read, b''))
+
+        return self._content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def close(self):
+        pass
+
+
+class Cassette(object):
+    """
+    Storage of recorded HTTP exchanges (request, response status, headers and the streamed body including keepalive
+    data together with timing information).
+
+    :param list exchanges: Optional list of recorded exchanges (used by :func:`load`).
+    """
+    version = 1
+
+    def __init__(self, exchanges=None):
+        self.exchanges = exchanges or []
+        self._recorded = []
+
+    def __repr__(self):
+        return '<Danube Cloud API :: %s [%d]>' % (self.__class__.__name__, len(self.exchanges))
+
+    def __len__(self):
+        return len(self.exchanges)
+
+    def record(self, transport=None):
+        """Return a :class:`.Client` transport, which performs real HTTP requests by using the transport
+        (default: :func:`requests.request`) and records all exchanges into this cassette.
+
+        Request data is stored together with its SHA-1 digest and size. Streamed request bodies (file-like objects and
+        iterables) can be arbitrarily large, so only their digest and size are stored.
+
+        :param callable transport: Optional transport with the same signature as :func:`requests.request`.
+        :return: Recording transport.
+        :rtype: callable
+        """
+        if transport is None:
+            transport = requests.request
+
+        def recording_transport(method, url, params=None, data=None, **kwargs):
+            request, data = _get_request(method, url, params=params, data=data, stream=True)
+            started = time.time()
+            response = transport(method, url, params=params, data=data, **kwargs)
+            exchange = {
+                'request': request,
+                'response': {
+                    'url': response.url,
+                    'status_code': response.status_code,
+                    'reason': getattr(response, 'reason', None),
+                    'headers': dict(response.headers),
+                    'elapsed': time.time() - started,
+                    'body': [],
+                },
+            }
+            recorded_response = _RecordedResponse(response, exchange, started + exchange['response']['elapsed'])
+            self.exchanges.append(exchange)
+            self._recorded.append(recorded_response)
+
+            return recorded_response
+
+        return recording_transport
+
+    def replay(self, realtime=False, repeat=False):
+        """Return a :class:`.Client` transport, which returns recorded responses instead of performing HTTP requests.
+        Requests are matched with recorded exchanges according to the HTTP method, URL, query parameters and the digest
+        of the request data in the order in which they were recorded. Keys of JSON encoded parameters are sorted before
+        computing the digest.
+
+        :param bool realtime: Whether to replay responses at recorded timing (default: `False` - full speed).
+        :param bool repeat: Whether to start from the beginning when all exchanges for a request were replayed
+         (default: `False`).
+        :return: Replaying transport.
+        :rtype: callable
+        :raise: :class:`.ESAPIRuntimeError` if no recorded exchange matches the request.
+        """
+        recorded = {}
+
+        for exchange in self.exchanges:
+            key = _get_request_key(exchange['request'])
+            recorded.setdefault(key, []).append(exchange)
+
+        queues = dict((key, deque(exchanges)) for key, exchanges in recorded.items())
+
+        def replaying_transport(method, url, params=None, data=None, **kwargs):
+            key = _get_request_key(_get_request(method, url, params=params, data=data)[0])
+            queue = queues.get(key, None)
+
+            if not queue:
+                if repeat and key in recorded:
+                    queue = queues[key] = deque(recorded[key])
+                else:
+                    raise ESAPIRuntimeError('No recorded exchange for %s %s' % key[:2])
+
+            exchange = queue.popleft()
+
+            if realtime:
+                time.sleep(exchange['response']['elapsed'])
+
+            return _ReplayedResponse(exchange, realtime=realtime)
+
+        return replaying_transport
+
+    def save(self, path):
+        """Save all recorded exchanges into a gzip compressed JSON file.
+        The rest of all unconsumed response bodies is fetched before saving.
+
+        :param str path: Cassette file path.
+        """
+        for recorded_response in self._recorded:
+            recorded_response.finish()
+
+        del self._recorded[:]
+        data = json.dumps({'version': self.version, 'exchanges': self.exchanges}, separators=(',', ':'))
+
+        with gzip.open(path, 'wb') as f:
+            f.write(data.encode('utf-8'))
+
+    @classmethod
+    def load(cls, path):
+        """Load exchanges from a cassette file created by :func:`save`.
+
+        :param str path: Cassette file path.
+        :return: Cassette object.
+        :rtype: :class:`.Cassette`
+        :raise: :class:`.ESAPIRuntimeError` if the cassette file version is not supported.
+        """
+        with gzip.open(path, 'rb') as f:
+            data = json.loads(f.read().decode('utf-8'))
+
+        if data.get('version', None) != cls.version:
+            raise ESAPIRuntimeError('Unsupported cassette version: %s' % data.get('version', None))
+
+        return cls(exchanges=data['exchanges'])
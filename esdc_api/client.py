@@ -10,13 +10,65 @@ import json
 import requests
 
 from . import __version__
-from .response import Response
+from .response import DEFAULT_CHUNK_SIZE, Response, monotonic
+from .watch import watch, tail_task_log
 
 __all__ = (
     'Client',
+    'iter_chunks',
 )
 
 
+def iter_chunks(body, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Return generator yielding request body data in chunks.
+
+    :param body: File-like object (read in chunks of chunk_size bytes) or iterable of `bytes`.
+     Text chunks are encoded to UTF-8.
+    :param int chunk_size: Size of chunks read from a file-like object (default: 64 KiB).
+    :return: Generator which yields `bytes`.
+    :rtype: generator
+    """
+    if hasattr(body, 'read'):
+        chunks = _read_chunks(body, chunk_size)
+    else:
+        chunks = body
+
+    for chunk in chunks:
+        if not isinstance(chunk, bytes):  # Text
+            chunk = chunk.encode('utf-8')
+
+        yield chunk
+
+
+def _read_chunks(fileobj, chunk_size):
+    """Return generator yielding data read from a file-like object in chunks of chunk_size."""
+    while True:
+        chunk = fileobj.read(chunk_size)
+
+        if not chunk:
+            break
+
+        yield chunk
+
+
+def _limit_timeout(timeout, limit):
+    """Return timeout (or tuple of timeouts) not greater than limit."""
+    if isinstance(timeout, tuple):
+        return tuple(_limit_timeout(i, limit) for i in timeout)
+
+    if timeout is None:
+        return limit
+
+    return min(timeout, limit)
+
+
+def _count_chunks(chunks, counter):
+    """Pass through all chunks and add their size to the first item of the counter list."""
+    for chunk in chunks:
+        counter[0] += len(chunk)
+        yield chunk
+
+
 class Client(object):
     """
     Danube Cloud API HTTP client.
@@ -25,15 +77,37 @@ class Client(object):
     :param str api_key: Optional API key used to perform authenticated requests.
     :param tuple auth: Optional auth tuple to enable Basic/Digest/Custom HTTP authentication.
     :param float timeout: How long to wait for the server to send data before giving up (default: `None`).
+     A (connect timeout, read timeout) tuple is also accepted.
+    :param float connect_timeout: Optional separate timeout for establishing the connection (default: `None`).
+    :param float deadline: Optional total time (in seconds) for a request including the wait for a streaming
+     response (default: `None`). See :func:`request`.
     :param bool ssl_verify: If `True`, the SSL cert will be verified (default: `True`).
+    :param callable transport: Optional function used to perform HTTP requests with the same signature as
+     :func:`requests.request` (default: :func:`requests.request`; see also :class:`.Cassette`).
+    :param metrics: Optional :class:`.Metrics` registry used for collecting request statistics (default: `None`).
+    :param int max_memory_size: Optional size of response content (in bytes) above which the content is stored in a
+     temporary file and exposed as a memory map instead of being kept in memory (default: `None`).
+    :param int max_content_size: Optional maximum size of response content (in bytes); fetching bigger content raises
+     :class:`.ESAPIRuntimeError` (default: `None`).
     """
-    def __init__(self, api_url='https://danube.cloud/api', api_key=None, auth=None, timeout=None, ssl_verify=True):
+    def __init__(self, api_url='https://danube.cloud/api', api_key=None, auth=None, timeout=None, ssl_verify=True,
+                 transport=None, metrics=None, connect_timeout=None, deadline=None, max_memory_size=None,
+                 max_content_size=None):
         """Initialize Danube Cloud API object."""
         assert not api_url.endswith('/'), 'trailing slash in api_url is not allowed'
 
+        if transport is None:
+            transport = requests.request
+
         self.api_url = api_url
+        self.transport = transport
+        self.metrics = metrics
         self.auth = auth
         self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.deadline = deadline
+        self.max_memory_size = max_memory_size
+        self.max_content_size = max_content_size
         self.ssl_verify = ssl_verify
         self.headers = {
             'User-Agent': 'esdc-api/python-client/%s' % __version__,
@@ -59,16 +133,25 @@ class Client(object):
 
         return url
 
-    def request(self, method, resource, timeout=None, stream=True, **params):
+    def request(self, method, resource, timeout=None, stream=True, body=None, headers=None, deadline=None, **params):
         """Perform request to server and return :class:`.Response` or
          raise an :class:`.ESAPIException`. This method is used by all public request methods in this class.
 
         :param str method: HTTP method.
         :param str resource: Danube Cloud API resource beginning with a slash (e.g. `/vm/<hostname>`).
         :param int timeout: Optional timeout for the request (default `None`).
+        :param float deadline: Optional total time (in seconds) for the request including the wait for a streaming
+         response. When it expires, :class:`.DeadlineExceeded` with the task ID is raised during content fetching;
+         the task keeps running on the server. The deadline is checked before every read of the content and the read
+         timeout is limited to the remaining time (default: `None`).
         :param bool stream: Whether to wait for asynchronous API calls to finish (default `True`).
+        :param body: Optional request body (`bytes`, `str`, file-like object or iterable of `bytes`), which is sent
+         instead of JSON encoded parameters. Text is encoded to UTF-8. File-like objects and iterables are sent in
+         chunks using chunked transfer encoding. The default JSON `Content-Type` header is not sent with the request
+         body; use the headers parameter to set it.
+        :param dict headers: Optional HTTP headers sent in addition to the default client headers.
         :param dict params: Request parameters internally translated into POST/PUT/DELETE JSON encoded data or
-         GET query string.
+         GET query string (or query string when the request `body` is set).
 
         :return: Response object.
         :rtype: :class:`.Response`
@@ -79,21 +162,80 @@ class Client(object):
         if timeout is None:
             timeout = self.timeout
 
-        if stream:
-            headers = self.headers
+        if self.connect_timeout is not None and not isinstance(timeout, tuple):
+            timeout = (self.connect_timeout, timeout)
+
+        if deadline is None:
+            deadline = self.deadline
+
+        if deadline is None:
+            expires = None
         else:
-            headers = self.headers.copy()
-            del headers['ES-STREAM']
+            expires = monotonic() + deadline
+            timeout = _limit_timeout(timeout, deadline)
+
+        default_headers = self.headers
 
-        if method.upper() == 'GET':
+        if body is not None:  # Custom request body is not JSON
+            default_headers = default_headers.copy()
+            default_headers.pop('Content-Type', None)
+
+        if headers:
+            headers = dict(default_headers, **headers)
+        elif stream:
+            headers = default_headers
+        else:
+            headers = default_headers.copy()
+
+        if not stream:
+            headers.pop('ES-STREAM', None)
+
+        if body is not None:
+            assert method.upper() != 'GET', 'request body is not allowed in GET requests'
+
+            if isinstance(body, bytes):
+                data = body
+            elif hasattr(body, 'encode'):  # Text
+                data = body.encode('utf-8')
+            else:
+                data = iter_chunks(body)
+        elif method.upper() == 'GET':
             data = None
         else:
             data = json.dumps(params)
             params = None
 
-        return Response(requests.request(method, url, params=params, data=data, headers=headers,
-                                         auth=self.auth, timeout=timeout, allow_redirects=False,
-                                         stream=stream, verify=self.ssl_verify))
+        metrics = self.metrics
+        # The response body is always streamed from the server and fetched by the Response object when needed
+        kwargs = {'params': params, 'headers': headers, 'auth': self.auth, 'timeout': timeout,
+                  'allow_redirects': False, 'stream': True, 'verify': self.ssl_verify}
+
+        response_kwargs = {'deadline': expires, 'max_memory_size': self.max_memory_size,
+                           'max_content_size': self.max_content_size}
+
+        if metrics is None:
+            return Response(self.transport(method, url, data=data, **kwargs), **response_kwargs)
+
+        method = method.upper()
+        template = metrics.resource_template(resource)
+        data_size = [0]
+
+        if data is None or isinstance(data, (bytes, str)):
+            data_size[0] = len(data or '')
+        else:
+            data = _count_chunks(data, data_size)
+
+        started = monotonic()
+
+        try:
+            response = self.transport(method, url, data=data, **kwargs)
+        except Exception as exc:
+            metrics.observe_error(method, template, exc)
+            raise
+
+        metrics.observe_request(method, template, monotonic() - started, data_size[0])
+
+        return Response(response, metrics=metrics, metrics_labels=(method, template), **response_kwargs)
 
     def get(self, resource, **kwargs):
         """Perform GET :func:`request <request>` to Danube Cloud API."""
@@ -150,6 +292,36 @@ class Client(object):
         """Return `True` if api_key is set or authorization token was saved by the :func:`login` method."""
         return 'ES-API-KEY' in self.headers or 'Authorization' in self.headers
 
+    def watch(self, resource, interval=10, key='hostname', initial=True, **params):
+        """Periodically :func:`GET <get>` a collection resource (e.g. `/vm` or `/node`) and yield only changes between
+        subsequent polls. See :func:`.watch.watch` for more details.
+
+        :param str resource: Danube Cloud API collection resource beginning with a slash.
+        :param float interval: Minimal time (in seconds) between two requests (default: 10).
+        :param key: Item attribute or function used to identify collection items (default: `hostname`).
+        :param bool initial: Whether to yield all items from the first poll as added (default: `True`).
+        :param dict params: Request parameters translated into GET query string.
+        :return: Generator which yields :class:`.WatchEvent` objects.
+        :rtype: generator
+        :raise: :class:`.ESAPIException`
+        """
+        return watch(self, resource, interval=interval, key=key, initial=initial, **params)
+
+    def tail_task_log(self, interval=10, since=None, initial=True, follow=True, **params):
+        """Periodically :func:`GET <get>` /task/log and yield only new task log entries.
+        See :func:`.watch.tail_task_log` for more details.
+
+        :param float interval: Minimal time (in seconds) between two requests (default: 10).
+        :param str since: Optional timestamp (in the task log time format); only newer entries are yielded.
+        :param bool initial: Whether to yield entries from the first poll (default: `True`).
+        :param bool follow: Whether to keep polling for new entries (default: `True`).
+        :param dict params: Other /task/log request parameters translated into GET query string.
+        :return: Generator which yields task log entries.
+        :rtype: generator
+        :raise: :class:`.ESAPIException`
+        """
+        return tail_task_log(self, interval=interval, since=since, initial=initial, follow=follow, **params)
+
     def ping(self):
         """:func:`GET <get>` /ping"""
         return self.get('/ping').content.result
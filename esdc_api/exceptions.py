@@ -9,6 +9,7 @@ This module contains all exceptions used by the Danube Cloud API library.
 __all__ = (
     'ESAPIException',
     'ESAPIRuntimeError',
+    'DeadlineExceeded',
     'ESAPIError',
     'ServerError',
     'ClientError',
@@ -32,6 +33,24 @@ class ESAPIRuntimeError(ESAPIException, RuntimeError):
     pass
 
 
+class DeadlineExceeded(ESAPIRuntimeError):
+    """Raised when the request deadline expires while waiting for the response.
+
+    The task continues to run on the server and its status can be checked later by using the :attr:`task_id`.
+
+    :param task_id: Task ID (optional).
+    :param dc: Danube Cloud virtual datacenter in which the task is running (optional).
+    """
+    def __init__(self, task_id=None, dc=None):
+        self.task_id = task_id
+        self.dc = dc
+
+        super(DeadlineExceeded, self).__init__(task_id)
+
+    def __str__(self):
+        return 'Deadline exceeded while waiting for task %s' % self.task_id
+
+
 class ESAPIError(ESAPIException):
     """Raised for all API errors incoming from Danube Cloud server.
 
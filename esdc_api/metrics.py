@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+esdc_api.metrics
+~~~~~~~~~~~~~~~~
+
+This module contains the :class:`Metrics` registry, which aggregates statistics about requests performed by
+Danube Cloud API :class:`.Client` objects. The statistics are keyed by HTTP method and a normalized resource template
+(e.g. `/vm/<hostname>/status`) and can be exported in the Prometheus (or OpenMetrics) text format::
+
+    >>> metrics = Metrics()
+    >>> es = Client(api_url='https://danube.cloud/api', api_key='<your-api-key>', metrics=metrics)
+    >>> es.get('/vm/example.com/status')
+    >>> print(metrics.export())
+"""
+
+import re
+import threading
+from bisect import bisect_left
+
+__all__ = (
+    'Metrics',
+)
+
+#: Default histogram buckets (in seconds) used for request durations and stream wait times.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+#: Content type of the Prometheus text exposition format.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+#: Content type of the OpenMetrics text exposition format.
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+#: Resource collections followed by an object identifier and the placeholder used in resource templates.
+RESOURCE_PARAMS = {
+    'vm': '<hostname>',
+    'node': '<hostname>',
+    'task': '<task_id>',
+    'dc': '<dc>',
+    'user': '<username>',
+    'group': '<name>',
+    'apikeys': '<name>',
+    'sshkey': '<title>',
+    'network': '<name>',
+    'ip': '<ip>',
+    'image': '<name>',
+    'imagestore': '<name>',
+    'template': '<name>',
+    'iso': '<name>',
+    'domain': '<name>',
+    'record': '<record_id>',
+    'storage': '<zpool>',
+    'disk': '<disk_id>',
+    'nic': '<nic_id>',
+    'snapshot': '<snapname>',
+    'backup': '<bkpname>',
+}
+
+#: Resource names, which are never treated as object identifiers (e.g. `/vm/define` or `/task/log`).
+RESOURCE_STATIC = frozenset((
+    'define', 'status', 'log', 'stats', 'report', 'current', 'settings', 'history', 'monitoring',
+))
+
+_ID_RE = re.compile(r'^(\d+|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})$')
+
+
+class _Histogram(object):
+    """Histogram data (observation counts per bucket and the sum of all observed values)."""
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, buckets):
+        self.counts = [0] * (len(buckets) + 1)  # The last one is the +Inf bucket
+        self.sum = 0.0
+
+
+class _Series(object):
+    """Statistics for one (method, resource template) pair."""
+    __slots__ = ('requests', 'bytes_out', 'bytes_in', 'duration', 'stream_wait')
+
+    def __init__(self, buckets):
+        self.requests = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.duration = _Histogram(buckets)
+        self.stream_wait = _Histogram(buckets)
+
+
+def _escape(value):
+    """Escape label value according to the Prometheus text format."""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Metrics(object):
+    """
+    Thread-safe registry of Danube Cloud API client metrics.
+
+    :param tuple buckets: Histogram buckets in seconds (default: :data:`DEFAULT_BUCKETS`).
+    :param dict resource_params: Mapping of resource collections to identifier placeholders used by
+     :func:`resource_template` (default: :data:`RESOURCE_PARAMS`).
+    :param str prefix: Metric name prefix (default: `esdc_api`).
+    """
+    cache_size = 4096
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, resource_params=None, prefix='esdc_api'):
+        self.buckets = tuple(sorted(buckets))
+        self.resource_params = resource_params or RESOURCE_PARAMS
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._series = {}
+        self._errors = {}
+        self._templates = {}
+
+    def __repr__(self):
+        return '<Danube Cloud API :: %s [%d]>' % (self.__class__.__name__, len(self._series))
+
+    def resource_template(self, resource):
+        """Return normalized resource template (e.g. `/vm/<hostname>/status` for `/vm/example.com/status`).
+
+        :param str resource: Danube Cloud API resource beginning with a slash.
+        :rtype: str
+        """
+        try:
+            return self._templates[resource]
+        except KeyError:
+            pass
+
+        params = self.resource_params
+        segments = resource.strip('/').split('/')
+        template = []
+        placeholder = None
+
+        for segment in segments:
+            if placeholder and segment not in RESOURCE_STATIC:
+                template.append(placeholder)
+                placeholder = None
+            elif _ID_RE.match(segment):
+                template.append('<id>')
+                placeholder = None
+            else:
+                template.append(segment)
+                placeholder = params.get(segment, None)
+
+        template = '/' + '/'.join(template)
+
+        if len(self._templates) >= self.cache_size:
+            self._templates.clear()
+
+        self._templates[resource] = template
+
+        return template
+
+    def _get_series(self, key):
+        """Return series object for the key. Must be called with the lock acquired."""
+        try:
+            return self._series[key]
+        except KeyError:
+            series = self._series[key] = _Series(self.buckets)
+            return series
+
+    def _observe(self, histogram, value):
+        histogram.counts[bisect_left(self.buckets, value)] += 1
+        histogram.sum += value
+
+    def observe_request(self, method, template, duration, bytes_out=0):
+        """Record one performed request.
+
+        :param str method: HTTP method.
+        :param str template: Resource template returned by :func:`resource_template`.
+        :param float duration: Time (in seconds) until the response headers were received.
+        :param int bytes_out: Size of the request body.
+        """
+        with self._lock:
+            series = self._get_series((method, template))
+            series.requests += 1
+            series.bytes_out += bytes_out
+            self._observe(series.duration, duration)
+
+    def observe_response(self, method, template, bytes_in=0, stream_wait=None):
+        """Record fetched response content.
+
+        :param str method: HTTP method.
+        :param str template: Resource template returned by :func:`resource_template`.
+        :param int bytes_in: Size of the response content.
+        :param float stream_wait: Time (in seconds) spent waiting for a streamed task response (optional).
+        """
+        with self._lock:
+            series = self._get_series((method, template))
+            series.bytes_in += bytes_in
+
+            if stream_wait is not None:
+                self._observe(series.stream_wait, stream_wait)
+
+    def observe_error(self, method, template, exc):
+        """Record an error.
+
+        :param str method: HTTP method.
+        :param str template: Resource template returned by :func:`resource_template`.
+        :param exc: Exception object or class.
+        """
+        if not isinstance(exc, type):
+            exc = exc.__class__
+
+        key = (method, template, exc.__name__)
+
+        with self._lock:
+            self._errors[key] = self._errors.get(key, 0) + 1
+
+    def reset(self):
+        """Remove all collected metrics."""
+        with self._lock:
+            self._series.clear()
+            self._errors.clear()
+
+    def _export_counter(self, lines, name, help_text, samples, openmetrics):
+        if openmetrics:
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s counter' % name)
+        else:
+            lines.append('# HELP %s_total %s' % (name, help_text))
+            lines.append('# TYPE %s_total counter' % name)
+
+        for labels, value in samples:
+            lines.append('%s_total{%s} %s' % (name, labels, _format_number(value)))
+
+    def _export_histogram(self, lines, name, help_text, samples):
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s histogram' % name)
+        bounds = [_format_number(float(i)) for i in self.buckets] + ['+Inf']
+
+        for labels, counts, total in samples:
+            count = 0
+
+            for bound, bucket_count in zip(bounds, counts):
+                count += bucket_count
+                lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, count))
+
+            lines.append('%s_sum{%s} %s' % (name, labels, _format_number(total)))
+            lines.append('%s_count{%s} %d' % (name, labels, count))
+
+    def export(self, openmetrics=False):
+        """Return all metrics in the Prometheus text exposition format (see :data:`CONTENT_TYPE`).
+
+        :param bool openmetrics: Use the OpenMetrics text format instead (see :data:`OPENMETRICS_CONTENT_TYPE`).
+        :rtype: str
+        """
+        requests, bytes_out, bytes_in, duration, stream_wait = [], [], [], [], []
+
+        with self._lock:
+            for (method, template), series in sorted(self._series.items()):
+                labels = 'method="%s",resource="%s"' % (_escape(method), _escape(template))
+                requests.append((labels, series.requests))
+                bytes_out.append((labels, series.bytes_out))
+                bytes_in.append((labels, series.bytes_in))
+                duration.append((labels, list(series.duration.counts), series.duration.sum))
+
+                if any(series.stream_wait.counts):
+                    stream_wait.append((labels, list(series.stream_wait.counts), series.stream_wait.sum))
+
+            errors = [('method="%s",resource="%s",exception="%s"' % (_escape(method), _escape(template), exc), count)
+                      for (method, template, exc), count in sorted(self._errors.items())]
+
+        prefix = self.prefix
+        lines = []
+        self._export_counter(lines, prefix + '_requests', 'Total number of Danube Cloud API requests.',
+                             requests, openmetrics)
+        self._export_counter(lines, prefix + '_request_bytes', 'Total size of request bodies in bytes.',
+                             bytes_out, openmetrics)
+        self._export_counter(lines, prefix + '_response_bytes', 'Total size of response content in bytes.',
+                             bytes_in, openmetrics)
+        self._export_counter(lines, prefix + '_errors', 'Total number of errors by exception class.',
+                             errors, openmetrics)
+        self._export_histogram(lines, prefix + '_request_duration_seconds',
+                               'Time until the response headers were received.', duration)
+        self._export_histogram(lines, prefix + '_stream_wait_seconds',
+                               'Time spent waiting for streamed task responses.', stream_wait)
+
+        if openmetrics:
+            lines.append('# EOF')
+
+        return '\n'.join(lines) + '\n'
@@ -7,30 +7,118 @@ This module provides the Response object returned by Danube Cloud API :class:`.C
 """
 
 import json
+import mmap
+import codecs
+import tempfile
 from collections import namedtuple
 
-from .exceptions import ESAPIRuntimeError, ServerError, ClientError, TaskError, TaskFailure, TaskRevoked
+from requests.exceptions import RequestException
+
+try:
+    from time import monotonic
+except ImportError:  # Python 2
+    from time import time as monotonic
+
+from .exceptions import (ESAPIRuntimeError, DeadlineExceeded, ServerError, ClientError, TaskError, TaskFailure,
+                         TaskRevoked)
 
 __all__ = (
     'Response',
     'Content'
 )
 
+#: Default size of chunks used when streaming request and response bodies.
+DEFAULT_CHUNK_SIZE = 65536
+
 #: Danube Cloud API Response content tuple returned by :attr:`.Response.content` property.
 Content = namedtuple('Content', ('result', 'dc', 'task_status', 'task_id'))
 
 
+class _ContentBuffer(object):
+    """Raw content buffer, which is kept in memory until it grows over max_memory_size bytes.
+    Bigger content is written into a temporary file and returned as a read-only memory map."""
+    def __init__(self, max_memory_size=None):
+        self.max_memory_size = max_memory_size
+        self.size = 0
+        self._chunks = []
+        self._file = None
+
+    def write(self, chunk):
+        self.size += len(chunk)
+
+        if self._file is None:
+            self._chunks.append(chunk)
+
+            if self.max_memory_size is not None and self.size > self.max_memory_size:
+                self._file = tempfile.TemporaryFile()
+
+                for i in self._chunks:
+                    self._file.write(i)
+
+                self._chunks = None
+        else:
+            self._file.write(chunk)
+
+    def getvalue(self):
+        if self._file is None:
+            return b''.join(self._chunks)
+
+        self._file.flush()
+
+        try:
+            return mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            self._file.close()
+
+
+def _strip_trailing_whitespace(chunks):
+    """Pass through all chunks (and `None` items) except trailing whitespace (keepalive data sent after the content
+    of a streaming response). Whitespace at the end of a chunk is held back until more data arrives."""
+    pending = b''
+
+    for chunk in chunks:
+        if chunk is None:
+            yield chunk
+            continue
+
+        data = chunk.rstrip()
+
+        if data:
+            if pending:
+                yield pending
+
+            yield data
+            pending = chunk[len(data):]
+        else:
+            pending += chunk
+
+
 class Response(object):
     """
     Danube Cloud API Response (wrapper around :class:`requests.Response <requests.Response>` class).
 
     :param response: The :class:`requests.Response <requests.Response>` object.
+    :param metrics: Optional :class:`.Metrics` registry used for collecting response statistics.
+    :param tuple metrics_labels: HTTP method and resource template used as keys in the metrics registry.
+    :param float deadline: Optional time (as returned by :func:`time.monotonic`) after which fetching the content
+     (including the wait for a streaming response) is aborted by raising :class:`.DeadlineExceeded`.
+    :param int max_memory_size: Optional size of raw content (in bytes) above which the raw content is stored in a
+     temporary file and exposed as a read-only :class:`mmap.mmap` object instead of `bytes`.
+    :param int max_content_size: Optional maximum size of raw content (in bytes). Bigger content is not fetched and
+     :class:`.ESAPIRuntimeError` is raised instead.
     """
-    def __init__(self, response):
+    def __init__(self, response, metrics=None, metrics_labels=None, deadline=None, max_memory_size=None,
+                 max_content_size=None):
         """Initialize the response object."""
         self._response = response
+        self._deadline = deadline
+        self._max_memory_size = max_memory_size
+        self._max_content_size = max_content_size
+        self._metrics = metrics
+        self._metrics_labels = metrics_labels
         self._content = None
         self._raw_content = None
+        self._raw_content_streamed = False
         self._status_code = None
         headers = response.headers
         #: Danube Cloud API version.
@@ -41,10 +129,16 @@ class Response(object):
 
     def __getstate__(self):
         # Fetch raw content before serializing
-        if self._raw_content is None:
+        if not self.ready:
             self.consume_raw_content()
 
-        return self.__dict__
+        state = self.__dict__.copy()
+        state['_metrics'] = None  # The metrics registry is bound to the current process
+
+        if isinstance(self._raw_content, mmap.mmap):
+            state['_raw_content'] = self._raw_content[:]
+
+        return state
 
     def __repr__(self):
         return '<Danube Cloud API :: %s [%s]>' % (self.__class__.__name__, self.status_code)
@@ -84,17 +178,61 @@ class Response(object):
 
         return ClientError
 
+    def _observe_error(self, exc):
+        """Record error in the metrics registry (if enabled)."""
+        if self._metrics is not None:
+            self._metrics.observe_error(self._metrics_labels[0], self._metrics_labels[1], exc)
+
+    def _observe_response(self, size, stream_wait):
+        """Record fetched content in the metrics registry (if enabled)."""
+        if self._metrics is not None:
+            self._metrics.observe_response(self._metrics_labels[0], self._metrics_labels[1], size, stream_wait)
+
+    def _observe_api_error(self):
+        """Parse the fetched raw content of an unsuccessful response and record the API error in the metrics registry
+        (if enabled)."""
+        if self._metrics is not None and not self.is_status_code_ok(self.status_code):
+            self._content = self.parse_raw_content(self._raw_content)
+            self._observe_error(self._content)
+
+    def _check_deadline(self):
+        """Close the connection and raise :class:`.DeadlineExceeded` if the deadline has expired. Otherwise limit the
+        read timeout of the connection to the remaining time so that the next read cannot block after the deadline."""
+        if self._deadline is None:
+            return
+
+        remaining = self._deadline - monotonic()
+
+        if remaining <= 0:
+            self._observe_error(DeadlineExceeded)
+            self._response.close()
+            raise DeadlineExceeded(self.task_id, self.dc)
+
+        # noinspection PyBroadException
+        try:  # The socket is not accessible with every transport (e.g. a replayed cassette)
+            sock = self._response.raw._fp.fp.raw._sock
+            timeout = sock.gettimeout()
+
+            if timeout is None or timeout > remaining:
+                sock.settimeout(remaining + 0.01)  # The deadline has always expired when the read times out
+        except Exception:
+            pass
+
     def parse_raw_content(self, raw_content):
         """Parse raw content and return content tuple or API error exception (without raising it).
 
         :param raw_content: Last item yielded by :func:`fetch_raw_content`.
         :return: :class:`.ESAPIError` or :class:`.Content`.
         """
-        assert isinstance(raw_content, bytes), 'Raw content must be an instance of bytes'
+        assert isinstance(raw_content, (bytes, mmap.mmap)), 'Raw content must be an instance of bytes or mmap'
 
         task_id = self.task_id
         task_status = detail = None
-        raw_content = raw_content.decode('utf-8')
+
+        if isinstance(raw_content, bytes):
+            raw_content = raw_content.decode('utf-8')
+        else:  # Decode directly from the memory map without creating a copy of bytes
+            raw_content = codecs.utf_8_decode(raw_content)[0]
 
         # noinspection PyBroadException
         try:
@@ -122,42 +260,214 @@ class Response(object):
 
     def fetch_raw_content(self):
         """Fetch content from the server and yield `None` while waiting for some data.
-        The last yielded item is always the raw content (`bytes`).
+        The last yielded item is always the raw content (`bytes` or :class:`mmap.mmap` if the content is bigger than
+        the `max_memory_size`). Raise :class:`.DeadlineExceeded` if the response deadline expires while waiting for
+        a streaming response.
 
-        :return: Generator which yields `None` until it yields the raw content (`bytes`).
+        :return: Generator which yields `None` until it yields the raw content (`bytes` or :class:`mmap.mmap`).
         :rtype: generator
+        :raise: :class:`.ESAPIRuntimeError`
         """
-        if self._raw_content is not None:
+        if self.ready:
             raise ESAPIRuntimeError('The raw content for this response was already consumed')
 
-        if self.stream:  # Streaming response
-            content = None
-
-            for chunk in self._response.iter_content(chunk_size=1):
-                if chunk.isspace():
-                    yield None
-                else:
-                    try:
-                        data = chunk + self._response.content
-                        data = data.strip().split(b'\n', 1)
-                        content = data.pop()
-                        self._status_code = int(data[0])
-                    except Exception as e:
-                        raise ESAPIRuntimeError('Could not read status code from streaming response: %s', e)
+        buf = _ContentBuffer(self._max_memory_size)
+        started = monotonic()
+        stream_wait = None
+
+        for chunk in self._iter_content_chunks(DEFAULT_CHUNK_SIZE):
+            if chunk is None:
+                yield None
+            else:
+                if stream_wait is None and self.stream:
+                    stream_wait = monotonic() - started
+
+                buf.write(chunk)
+
+        content = buf.getvalue()
+        self._raw_content = content
+        self._observe_response(len(content), stream_wait)
+        self._observe_api_error()
+
+        yield content
+
+    def _iter_content_chunks(self, chunk_size):
+        """Same as :func:`_iter_raw_chunks`, but without the trailing whitespace of a streaming response."""
+        chunks = self._iter_raw_chunks(chunk_size)
+
+        if self.stream:
+            chunks = _strip_trailing_whitespace(chunks)
+
+        return chunks
+
+    def _iter_raw_chunks(self, chunk_size):
+        """Fetch content from the server without buffering it. Yield `None` while waiting for some data and then
+        yield the raw content in chunks. The status code of a streaming response is known after the first chunk.
+        Raise :class:`.ESAPIRuntimeError` if the content is bigger than the `max_content_size` and
+        :class:`.DeadlineExceeded` if the deadline expires before all content is fetched."""
+        response = self._response
+        max_content_size = self._max_content_size
+        check_deadline = self._check_deadline
+
+        if max_content_size is not None:
+            try:
+                content_length = int(response.headers.get('Content-Length', None))
+            except (TypeError, ValueError):
+                pass
+            else:
+                if content_length > max_content_size:
+                    self._content_size_exceeded()
+
+        try:
+            check_deadline()
+
+            if self.stream:  # Streaming response
+                status_line = b''
+
+                for chunk in response.iter_content(chunk_size=1):
+                    if chunk.isspace():
+                        yield None
+                        check_deadline()
                     else:
+                        status_line = chunk
+                        break
+
+                chunks = response.iter_content(chunk_size=chunk_size)
+
+                while status_line and b'\n' not in status_line:
+                    check_deadline()
+                    chunk = next(chunks, None)
+
+                    if chunk is None:
                         break
+
+                    status_line += chunk
+
+                    if (max_content_size is not None and len(status_line) > max_content_size and
+                            b'\n' not in status_line):
+                        self._content_size_exceeded()
+
+                status_code, newline, chunk = status_line.partition(b'\n')
+
+                try:
+                    if not newline:
+                        raise ValueError('missing status line')
+                    self._status_code = int(status_code)
+                except Exception as e:
+                    self._observe_error(ESAPIRuntimeError)
+                    raise ESAPIRuntimeError('Could not read status code from streaming response: %s' % e)
+
+                size = len(chunk)
+
+                if max_content_size is not None and size > max_content_size:
+                    self._content_size_exceeded()
+
+                yield chunk
+                check_deadline()
+            else:
+                size = 0
+                chunks = response.iter_content(chunk_size=chunk_size)
+
+            for chunk in chunks:
+                size += len(chunk)
+
+                if max_content_size is not None and size > max_content_size:
+                    self._content_size_exceeded()
+
+                yield chunk
+                check_deadline()
+        except RequestException as exc:
+            # The server could have stopped sending data and the read timed out
+            check_deadline()
+            self._observe_error(exc)
+            raise
+
+    def _content_size_exceeded(self):
+        """Close the connection and raise :class:`.ESAPIRuntimeError`."""
+        self._observe_error(ESAPIRuntimeError)
+        self._response.close()
+        raise ESAPIRuntimeError('The raw content for this response exceeds the maximum size of %d bytes'
+                                % self._max_content_size)
+
+    def iter_raw_content(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Fetch raw content from the server in chunks without buffering it in memory (unless the raw content was
+        already fetched). The raw content cannot be fetched again after calling this method.
+        Unsuccessful responses are read completely and the API error is raised instead.
+
+        :param int chunk_size: Maximum size of yielded chunks (default: 64 KiB).
+        :return: Generator which yields the raw content (`bytes`) in chunks.
+        :rtype: generator
+        :raise: :class:`.ESAPIError`
+        """
+        if self._raw_content is not None:
+            if not self.ok:
+                # noinspection PyStatementEffect
+                self.content  # raises ESAPIError
+
+            raw_content = self._raw_content
+
+            for i in range(0, len(raw_content), chunk_size):
+                yield raw_content[i:i + chunk_size]
+
+            return
+
+        if self._raw_content_streamed:
+            raise ESAPIRuntimeError('The raw content for this response was already consumed')
+
+        self._raw_content_streamed = True
+        started = monotonic()
+        chunks = (chunk for chunk in self._iter_content_chunks(chunk_size) if chunk is not None)
+        chunk = next(chunks, b'')  # The status code is known from now on
+        size = len(chunk)
+        stream_wait = monotonic() - started if self.stream else None
+
+        if not self.is_status_code_ok(self.status_code):
+            self._raw_content = chunk + b''.join(chunks)
+            self._observe_response(len(self._raw_content), stream_wait)
+            self._observe_api_error()
+            # noinspection PyStatementEffect
+            self.content  # raises ESAPIError
+
+        if chunk:
+            yield chunk
+
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+
+        self._observe_response(size, stream_wait)
+
+    def save_raw_content(self, destination, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Write raw content fetched by :func:`iter_raw_content` into a file or callback in chunks.
+
+        :param destination: File name, file-like object opened in binary mode or a callable, which will be called
+         with every chunk of data.
+        :param int chunk_size: Maximum size of written chunks (default: 64 KiB).
+        :return: Number of written bytes.
+        :rtype: int
+        :raise: :class:`.ESAPIError`
+        """
+        if hasattr(destination, 'write'):
+            write = destination.write
+        elif callable(destination):
+            write = destination
         else:
-            content = self._response.content
+            with open(destination, 'wb') as f:
+                return self.save_raw_content(f, chunk_size=chunk_size)
 
-        self._raw_content = content
+        size = 0
 
-        yield content
+        for chunk in self.iter_raw_content(chunk_size=chunk_size):
+            write(chunk)
+            size += len(chunk)
+
+        return size
 
     def consume_raw_content(self):
         """Iterate over the generator returned by :func:`fetch_raw_content` and return the last item - the raw content.
 
         :return: Raw content.
-        :rtype: bytes
+        :rtype: bytes or :class:`mmap.mmap`
         """
         return list(self.fetch_raw_content())[-1]
 
@@ -166,7 +476,7 @@ class Response(object):
         """Return raw content. Fetch and cache it by using :func:`consume_raw_content`; if not already consumed.
 
         :return: Raw content.
-        :rtype: bytes
+        :rtype: bytes or :class:`mmap.mmap`
         """
         if self._raw_content is None:
             return self.consume_raw_content()
@@ -189,7 +499,7 @@ class Response(object):
         :return: Raw content status.
         :rtype: bool
         """
-        return self._raw_content is not None
+        return self._raw_content is not None or self._raw_content_streamed
 
     @property
     def content(self):
@@ -214,7 +524,7 @@ class Response(object):
         :return: Response status according to the HTTP status code.
         :rtype: bool
         """
-        if self._raw_content is None:
+        if not self.ready:
             self.consume_raw_content()
 
         return self.is_status_code_ok(self.status_code)
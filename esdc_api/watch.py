@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+esdc_api.watch
+~~~~~~~~~~~~~~
+
+This module contains helpers for efficient polling of Danube Cloud API resources used by the :class:`.Client` class.
+"""
+
+import json
+import time
+import hashlib
+from collections import namedtuple
+
+__all__ = (
+    'WatchEvent',
+    'watch',
+    'tail_task_log',
+)
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+
+#: Change event yielded by :func:`watch` (`type` is one of `added`, `removed` or `changed`).
+#: Removed events contain the last known item.
+WatchEvent = namedtuple('WatchEvent', ('type', 'key', 'item'))
+
+
+def _fingerprint(item):
+    """Return a short digest of a collection item."""
+    return hashlib.md5(json.dumps(item, sort_keys=True).encode('utf-8')).digest()
+
+
+def _get_items(result, key):
+    """Return list of (key, item) pairs from a collection result."""
+    if isinstance(result, dict):
+        return list(result.items())
+
+    if callable(key):
+        return [(key(item), item) for item in result]
+
+    return [(item[key] if isinstance(item, dict) else item, item) for item in result]
+
+
+def watch(client, resource, interval=10, key='hostname', initial=True, **params):
+    """Periodically :func:`GET <.Client.get>` a collection resource and yield :class:`WatchEvent` objects for items
+    which were added, removed or changed since the previous poll.
+
+    Conditional requests (`If-None-Match` and `If-Modified-Since`) are used if the server sends `ETag` or
+    `Last-Modified` headers. Unchanged responses are detected by comparing digests of the raw content and are not
+    parsed at all. Every item is identified by the key and only a digest of each item is compared between polls.
+
+    :param client: The :class:`.Client` object.
+    :param str resource: Danube Cloud API collection resource beginning with a slash (e.g. `/vm`).
+    :param float interval: Minimal time (in seconds) between two requests (default: 10).
+    :param key: Item attribute or function used to identify collection items (default: `hostname`).
+     Items, which are not dictionaries (e.g. list of hostnames), are used as keys.
+    :param bool initial: Whether to yield all items from the first poll as added (default: `True`).
+    :param dict params: Request parameters translated into GET query string.
+    :return: Generator which yields :class:`WatchEvent` objects.
+    :rtype: generator
+    :raise: :class:`.ESAPIException`
+    """
+    known = None  # key -> (fingerprint, item)
+    digest = None
+    headers = {}
+
+    while True:
+        started = time.time()
+        response = client.get(resource, stream=False, headers=headers, **params)
+
+        if response.status_code != 304:
+            if not response.ok:
+                # noinspection PyStatementEffect
+                response.content  # raises ESAPIError
+
+            raw_digest = hashlib.md5(response.raw_content).digest()
+
+            if raw_digest != digest:
+                items = _get_items(response.content.result, key)
+                current = {}
+                events = []
+
+                for item_key, item in items:
+                    fingerprint = _fingerprint(item)
+                    current[item_key] = (fingerprint, item)
+
+                    if known is None:
+                        if initial:
+                            events.append(WatchEvent(ADDED, item_key, item))
+                    elif item_key not in known:
+                        events.append(WatchEvent(ADDED, item_key, item))
+                    elif known[item_key][0] != fingerprint:
+                        events.append(WatchEvent(CHANGED, item_key, item))
+
+                if known is not None:
+                    for item_key, (_, item) in known.items():
+                        if item_key not in current:
+                            events.append(WatchEvent(REMOVED, item_key, item))
+
+                known = current
+                digest = raw_digest
+
+                for event in events:
+                    yield event
+
+            headers = {}
+            etag = response.headers.get('ETag', None)
+            last_modified = response.headers.get('Last-Modified', None)
+
+            if etag:
+                headers['If-None-Match'] = etag
+
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        delay = interval - (time.time() - started)
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _get_task_log_cursor(timestamp):
+    """Return the date part of a timestamp, which can be used in the `date_from` filter of `/task/log`."""
+    return timestamp[:10]
+
+
+def tail_task_log(client, interval=10, since=None, initial=True, follow=True, time_key='time',
+                  cursor_param='date_from', cursor_value=_get_task_log_cursor, **params):
+    """Periodically :func:`GET <.Client.get>` `/task/log` and yield only new task log entries (dictionaries) in
+    chronological order.
+
+    The timestamp of the newest entry is used as a cursor. Only entries newer than the cursor are requested by sending
+    the `date_from` filter (the API filters by date, so the rest is filtered on the client side) and entries with the
+    same timestamp as the cursor, which were already yielded, are skipped. Unchanged responses are not parsed at all.
+
+    :param client: The :class:`.Client` object.
+    :param float interval: Minimal time (in seconds) between two requests (default: 10).
+    :param str since: Optional timestamp (in the task log time format); only newer entries are yielded.
+    :param bool initial: Whether to yield entries from the first poll (default: `True`).
+    :param bool follow: Whether to keep polling for new entries; if `False` only one request is made (default: `True`).
+    :param str time_key: Name of the entry timestamp attribute (default: `time`).
+    :param str cursor_param: Name of the request parameter used for filtering new entries (default: `date_from`).
+    :param callable cursor_value: Function returning the value of the cursor parameter for the cursor timestamp.
+    :param dict params: Other `/task/log` request parameters translated into GET query string.
+    :return: Generator which yields task log entries.
+    :rtype: generator
+    :raise: :class:`.ESAPIException`
+    """
+    cursor = since
+    seen = None  # fingerprints of yielded entries with the cursor timestamp (None = all entries were seen)
+    digest = None
+    first = True
+
+    while True:
+        started = time.time()
+        query = params.copy()
+
+        if cursor is not None:
+            query[cursor_param] = cursor_value(cursor)
+
+        response = client.get('/task/log', stream=False, **query)
+
+        if not response.ok:
+            # noinspection PyStatementEffect
+            response.content  # raises ESAPIError
+
+        raw_digest = hashlib.md5(response.raw_content).digest()
+
+        if raw_digest != digest:
+            digest = raw_digest
+            entries = response.content.result
+
+            if isinstance(entries, dict):  # Paginated response
+                entries = entries.get('results', [])
+
+            new_entries = []
+
+            for entry in entries:
+                entry_time = entry[time_key]
+
+                if cursor is None or entry_time > cursor:
+                    new_entries.append(entry)
+                elif entry_time == cursor and seen is not None:
+                    fingerprint = _fingerprint(entry)
+
+                    if fingerprint not in seen:
+                        seen.add(fingerprint)
+                        new_entries.append(entry)
+
+            # Task log entries are ordered from the newest to the oldest by default
+            new_entries.sort(key=lambda e: e[time_key])
+
+            if new_entries and new_entries[-1][time_key] != cursor:
+                cursor = new_entries[-1][time_key]
+                seen = set(_fingerprint(e) for e in new_entries if e[time_key] == cursor)
+
+            if initial or not first:
+                for entry in new_entries:
+                    yield entry
+
+        first = False
+
+        if not follow:
+            break
+
+        delay = interval - (time.time() - started)
+
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+esdc_api.workflow
+~~~~~~~~~~~~~~~~~
+
+This module contains the :class:`Workflow` class used for running many dependent Danube Cloud API requests
+(e.g. multi-step VM provisioning) concurrently::
+
+    >>> es = Client(api_url='https://danube.cloud/api', api_key='<your-api-key>')
+    >>> wf = Workflow(es, max_workers=20)
+    >>> for i in range(100):
+    ...     wf.add_vm('web%02d.example.com' % i, define={'template': 'web'}, disks=[{'image': 'centos'}], nics=[{}])
+    >>> results = wf.run()
+    >>> failed = [r for r in results.values() if r.status != SUCCESS]
+
+Steps are executed as soon as all their required steps have finished successfully. Steps on the longest remaining
+dependency chain are started first. If a step fails (e.g. with :class:`.TaskFailure` or :class:`.TaskRevoked`), only
+steps depending on it are skipped.
+"""
+
+import threading
+from collections import namedtuple
+
+try:
+    from collections import OrderedDict
+except ImportError:  # Python 2.6
+    OrderedDict = dict
+
+from .exceptions import ESAPIRuntimeError, DeadlineExceeded
+from .response import monotonic
+
+__all__ = (
+    'Step',
+    'StepResult',
+    'Workflow',
+)
+
+SUCCESS = 'SUCCESS'
+FAILURE = 'FAILURE'
+SKIPPED = 'SKIPPED'
+
+#: Result of one workflow step returned by :func:`Workflow.run`. The `status` is one of `SUCCESS`, `FAILURE` or
+#: `SKIPPED`; `content` is the :class:`.Content` of a successful step; `error` is the exception raised by a failed
+#: step (or by the failed required step of a skipped step).
+StepResult = namedtuple('StepResult', ('name', 'status', 'content', 'error'))
+
+
+class Step(object):
+    """
+    One Danube Cloud API request in a :class:`Workflow`.
+
+    :param str name: Unique step name.
+    :param str method: HTTP method.
+    :param str resource: Danube Cloud API resource beginning with a slash.
+    :param tuple requires: Names of steps, which must successfully finish before this step is started.
+    :param str group: Optional concurrency group name (see the `limits` parameter of :class:`Workflow`).
+    :param dict params: Request parameters passed to :func:`.Client.request`.
+    """
+    def __init__(self, name, method, resource, requires=(), group=None, **params):
+        self.name = name
+        self.method = method
+        self.resource = resource
+        self.requires = tuple(requires)
+        self.group = group
+        self.params = params
+
+    def __repr__(self):
+        return '<Danube Cloud API :: %s [%s]>' % (self.__class__.__name__, self.name)
+
+
+class Workflow(object):
+    """
+    Dependency-aware scheduler of Danube Cloud API requests.
+
+    :param client: The :class:`.Client` object used for performing requests.
+    :param int max_workers: Maximum number of concurrently running steps (default: 10).
+    :param dict limits: Optional maximum numbers of concurrently running steps per step group (e.g. per compute node).
+    """
+    def __init__(self, client, max_workers=10, limits=None):
+        self.client = client
+        self.max_workers = max_workers
+        self.limits = limits or {}
+        self.steps = OrderedDict()
+
+    def __repr__(self):
+        return '<Danube Cloud API :: %s [%d]>' % (self.__class__.__name__, len(self.steps))
+
+    def add(self, name, method, resource, requires=(), group=None, **params):
+        """Add a :class:`Step` into the workflow.
+
+        :return: Step object.
+        :rtype: :class:`Step`
+        """
+        assert name not in self.steps, 'step %s already exists' % name
+        step = self.steps[name] = Step(name, method, resource, requires=requires, group=group, **params)
+
+        return step
+
+    def add_vm(self, hostname, define=None, disks=(), nics=(), deploy=True, start=False, requires=(), group=None):
+        """Add steps for creating a VM: `POST /vm/<hostname>/define`, followed by disk and NIC definitions
+        (`POST /vm/<hostname>/define/disk/<disk_id>` and `POST /vm/<hostname>/define/nic/<nic_id>`), followed by
+        the deployment (`POST /vm/<hostname>`) and an optional `PUT /vm/<hostname>/status/start`.
+        Disks and NICs are defined one after another, but disk definitions run concurrently with NIC definitions.
+
+        Steps are named `<hostname>:define`, `<hostname>:disk:<disk_id>`, `<hostname>:nic:<nic_id>`,
+        `<hostname>:deploy` and `<hostname>:start`.
+
+        :param str hostname: VM hostname.
+        :param dict define: VM definition parameters.
+        :param list disks: List of disk definition parameters.
+        :param list nics: List of NIC definition parameters.
+        :param bool deploy: Whether to deploy the VM (default: `True`).
+        :param bool start: Whether to start the VM after deployment (default: `False`).
+        :param tuple requires: Names of steps, which must finish before the VM definition is created.
+        :param str group: Optional concurrency group name used for all VM steps.
+        :return: Name of the last step.
+        :rtype: str
+        """
+        prefix = '/vm/%s' % hostname
+        last = self.add('%s:define' % hostname, 'POST', prefix + '/define', requires=requires, group=group,
+                        **(define or {})).name
+        defined = [last]
+
+        for device, definitions in (('disk', disks), ('nic', nics)):
+            previous = last
+
+            for i, params in enumerate(definitions, 1):
+                previous = self.add('%s:%s:%d' % (hostname, device, i), 'POST',
+                                    '%s/define/%s/%d' % (prefix, device, i), requires=(previous,), group=group,
+                                    **params).name
+
+            if previous != last:
+                defined.append(previous)
+
+        if deploy:
+            last = self.add('%s:deploy' % hostname, 'POST', prefix, requires=defined, group=group).name
+
+            if start:
+                last = self.add('%s:start' % hostname, 'PUT', prefix + '/status/start', requires=(last,),
+                                group=group).name
+        else:
+            last = defined[-1]
+
+        return last
+
+    def _get_priorities(self):
+        """Return the length of the longest dependency chain starting with each step and dependents of each step.
+        Raise :class:`.ESAPIRuntimeError` if a step requires an unknown step or if there is a dependency cycle."""
+        steps = self.steps
+        dependents = dict((name, []) for name in steps)
+        pending = {}
+
+        for name, step in steps.items():
+            for required in step.requires:
+                if required not in steps:
+                    raise ESAPIRuntimeError('Step %s requires unknown step %s' % (name, required))
+                dependents[required].append(name)
+
+            pending[name] = len(step.requires)
+
+        # Topological order (Kahn's algorithm)
+        order = [name for name, count in pending.items() if not count]
+
+        for name in order:
+            for dependent in dependents[name]:
+                pending[dependent] -= 1
+
+                if not pending[dependent]:
+                    order.append(dependent)
+
+        if len(order) != len(steps):
+            raise ESAPIRuntimeError('Workflow contains a dependency cycle')
+
+        priorities = {}
+
+        for name in reversed(order):
+            priorities[name] = 1 + max([priorities[i] for i in dependents[name]] or [0])
+
+        return priorities, dependents
+
+    def _run_step(self, step, expires=None):
+        """Perform the request and wait for the result. The request deadline is limited by the workflow deadline."""
+        params = step.params
+
+        if expires is not None:
+            remaining = expires - monotonic()
+
+            if remaining <= 0:
+                return StepResult(step.name, FAILURE, None, DeadlineExceeded())
+
+            if params.get('deadline', None) is None or params['deadline'] > remaining:
+                params = dict(params, deadline=remaining)
+
+        # noinspection PyBroadException
+        try:
+            content = self.client.request(step.method, step.resource, **params).content
+        except Exception as exc:
+            return StepResult(step.name, FAILURE, None, exc)
+        else:
+            return StepResult(step.name, SUCCESS, content, None)
+
+    def run(self, deadline=None):
+        """Run all steps and wait for all of them to finish.
+
+        :param float deadline: Optional total time (in seconds) for the whole workflow. The remaining time is used as
+         the deadline of every started step. Steps, which would start after the deadline has expired, fail with
+         :class:`.DeadlineExceeded` (default: `None`).
+        :return: Ordered dictionary of step names and :class:`StepResult` objects.
+        :rtype: dict
+        :raise: :class:`.ESAPIRuntimeError` if a step requires an unknown step or if there is a dependency cycle.
+        """
+        if deadline is None:
+            expires = None
+        else:
+            expires = monotonic() + deadline
+
+        steps = self.steps
+        limits = self.limits
+        priorities, dependents = self._get_priorities()
+        pending = dict((name, len(step.requires)) for name, step in steps.items())
+        order = dict((name, i) for i, name in enumerate(steps))
+        ready = [name for name, count in pending.items() if not count]
+        running = {}  # group -> number of running steps
+        results = {}
+        condition = threading.Condition()
+
+        def sort_key(name):
+            return -priorities[name], order[name]
+
+        def skip(name, error):
+            for dependent in dependents[name]:
+                if dependent not in results:
+                    results[dependent] = StepResult(dependent, SKIPPED, None, error)
+                    skip(dependent, error)
+
+        def next_step():
+            """Return next runnable step. Must be called with the condition acquired."""
+            ready.sort(key=sort_key)
+
+            for i, name in enumerate(ready):
+                group = steps[name].group
+
+                if group is None or running.get(group, 0) < limits.get(group, len(steps)):
+                    running[group] = running.get(group, 0) + 1
+                    return steps[ready.pop(i)]
+
+            return None
+
+        def worker():
+            while True:
+                with condition:
+                    step = next_step()
+
+                    while step is None:
+                        if len(results) == len(steps):
+                            return
+                        condition.wait()
+                        step = next_step()
+
+                result = self._run_step(step, expires)
+
+                with condition:
+                    results[step.name] = result
+                    running[step.group] -= 1
+
+                    if result.status == SUCCESS:
+                        for dependent in dependents[step.name]:
+                            pending[dependent] -= 1
+
+                            if not pending[dependent] and dependent not in results:
+                                ready.append(dependent)
+                    else:
+                        skip(step.name, result.error)
+
+                    condition.notify_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(max(1, min(self.max_workers, len(steps))))]
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        return OrderedDict((name, results[name]) for name in steps)